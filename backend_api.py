@@ -8,19 +8,27 @@ Endpoints provided:
 - POST /api/settings
 - POST /api/upload         (photos)
 - POST /api/upload-background
-- POST /api/generate-mosaic
+- POST /api/generate-mosaic     ({"output": "dzi"} builds a Deep Zoom tile pyramid instead)
+- GET  /api/pyramid/latest
+- GET  /api/pyramid/<build_id>/<path>
 - POST /api/send-unlock
 
 Notes:
 - Saves uploaded photos to data/photos and settings to data/settings.pkl using existing utils.
-- Attempts to call utils.mosaic.generate_mosaic; if that function depends on Streamlit it may raise — the endpoint returns errors clearly.
+- Safe to run with several worker processes (gunicorn -c gunicorn.conf.py backend_api:app):
+  every mutable file in DATA_DIR is written under a cross-process lock and replaced
+  atomically (utils.storage). Heavy modules (cv2, scipy) are only imported inside the
+  mosaic endpoints so workers boot quickly.
+- Renders mosaics with the Streamlit-free stages in utils.mosaic; if opencv/scipy are missing the endpoint returns errors clearly.
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, send_from_directory
 from flask_cors import CORS
 import os
 import json
 import base64
+import shutil
+import time
 try:
     # Load .env during local development if python-dotenv is installed.
     from dotenv import load_dotenv
@@ -29,14 +37,24 @@ except Exception:
     pass
 from utils import settings as settings_util
 from utils import email as email_util
+from utils import storage
 
 app = Flask(__name__)
 CORS(app)
 
 DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
 PHOTOS_DIR = os.path.join(DATA_DIR, 'photos')
+PYRAMIDS_DIR = os.path.join(DATA_DIR, 'pyramids')
 os.makedirs(PHOTOS_DIR, exist_ok=True)
 
+# Pyramid tiles live under a fresh build id per generation, so their URLs never
+# change content and can be cached forever; only /api/pyramid/latest is revalidated.
+PYRAMID_CACHE_SECONDS = 365 * 24 * 3600
+PYRAMID_BUILDS_KEPT = 2
+# Unfinished builds (no manifest yet) are only removed once this old, so a build
+# still being written by another worker is never deleted.
+PYRAMID_STALE_SECONDS = 3600
+
 
 def messages_json_path():
     return os.path.join(DATA_DIR, 'messages.json')
@@ -69,15 +87,8 @@ def get_messages():
 @app.route('/api/messages', methods=['POST'])
 def post_message():
     data = request.get_json() or {}
-    path = messages_json_path()
-    messages = []
-    if os.path.exists(path):
-        with open(path, 'r') as f:
-            messages = json.load(f)
-    messages.append(data)
-    os.makedirs(DATA_DIR, exist_ok=True)
-    with open(path, 'w') as f:
-        json.dump(messages, f, indent=2)
+    with storage.update_json(messages_json_path(), []) as messages:
+        messages.append(data)
     return jsonify({'ok': True}), 201
 
 
@@ -90,11 +101,10 @@ def get_settings():
 @app.route('/api/settings', methods=['POST'])
 def post_settings():
     data = request.get_json() or {}
-    s = settings_util.load_settings() or {}
-    # accept unlock_date and graduate_email keys
-    s['unlock_date'] = data.get('unlock_date') or s.get('unlock_date')
-    s['graduate_email'] = data.get('graduate_email') or s.get('graduate_email')
-    settings_util.save_settings(s)
+    with settings_util.update_settings() as s:
+        # accept unlock_date and graduate_email keys
+        s['unlock_date'] = data.get('unlock_date') or s.get('unlock_date')
+        s['graduate_email'] = data.get('graduate_email') or s.get('graduate_email')
     return jsonify({'ok': True})
 
 
@@ -106,7 +116,8 @@ def upload_photos():
     for f in files:
         filename = f.filename
         dest = os.path.join(PHOTOS_DIR, filename)
-        f.save(dest)
+        with storage.atomic_path(dest) as tmp:
+            f.save(tmp)
         saved.append(filename)
     return jsonify({'saved': saved})
 
@@ -121,30 +132,97 @@ def upload_background():
     # preserve extension
     filename = f.filename or 'background.jpg'
     out_path = os.path.join(DATA_DIR, filename)
-    f.save(out_path)
-    s = settings_util.load_settings()
-    s['target_image'] = out_path
-    settings_util.save_settings(s)
+    with storage.file_lock(out_path), storage.atomic_path(out_path) as tmp:
+        f.save(tmp)
+    with settings_util.update_settings() as s:
+        s['target_image'] = out_path
     return jsonify({'saved': filename})
 
 
+def pyramid_latest_path():
+    return os.path.join(PYRAMIDS_DIR, 'latest.json')
+
+
+def prune_pyramids(published_id, keep):
+    """Remove builds older than the published one, keeping keep builds in total.
+
+    Newer builds are left alone (they may still be rendering), and so are
+    unfinished older ones until they are PYRAMID_STALE_SECONDS old.
+    """
+    finished = []
+    for build_id in os.listdir(PYRAMIDS_DIR):
+        build_dir = os.path.join(PYRAMIDS_DIR, build_id)
+        if not build_id.isdigit() or int(build_id) >= int(published_id):
+            continue
+        if os.path.exists(os.path.join(build_dir, 'mosaic.dzi')):
+            finished.append(build_id)
+        elif time.time() - os.path.getmtime(build_dir) > PYRAMID_STALE_SECONDS:
+            shutil.rmtree(build_dir, ignore_errors=True)
+    finished.sort(key=int)
+    for build_id in finished[:max(0, len(finished) - (keep - 1))]:
+        shutil.rmtree(os.path.join(PYRAMIDS_DIR, build_id), ignore_errors=True)
+
+
+def generate_pyramid(grid_size):
+    from utils import analysis
+    from utils import mosaic as mosaic_util
+    target = settings_util.load_settings().get('target_image')
+    tile_size = analysis.tile_size_for_grid(grid_size)
+    build_id = str(time.time_ns())
+    manifest = os.path.join(PYRAMIDS_DIR, build_id, 'mosaic.dzi')
+    index = mosaic_util.build_tile_index(PHOTOS_DIR, tile_size)
+    mosaic_util.render_mosaic(target, index, manifest, output='dzi')
+    dzi_url = f'/api/pyramid/{build_id}/mosaic.dzi'
+    with storage.file_lock(pyramid_latest_path()):
+        # A slow build finishing after a newer one must not move "latest" backwards
+        latest = storage.read_json(pyramid_latest_path()) or {}
+        if int(build_id) > int(latest.get('build_id', 0)):
+            storage.atomic_write(pyramid_latest_path(), json.dumps({'build_id': build_id, 'dzi_url': dzi_url}))
+            latest = {'build_id': build_id}
+        prune_pyramids(latest['build_id'], PYRAMID_BUILDS_KEPT)
+    return dzi_url
+
+
+@app.route('/api/pyramid/latest', methods=['GET'])
+def get_latest_pyramid():
+    latest = storage.read_json(pyramid_latest_path())
+    if latest is None:
+        return jsonify({'error': 'no pyramid generated'}), 404
+    resp = jsonify(latest)
+    resp.headers['Cache-Control'] = 'no-cache'
+    return resp
+
+
+@app.route('/api/pyramid/<build_id>/<path:filename>', methods=['GET'])
+def get_pyramid_file(build_id, filename):
+    resp = send_from_directory(PYRAMIDS_DIR, f'{build_id}/{filename}', max_age=PYRAMID_CACHE_SECONDS)
+    resp.headers['Cache-Control'] = f'public, max-age={PYRAMID_CACHE_SECONDS}, immutable'
+    return resp
+
+
 @app.route('/api/generate-mosaic', methods=['POST'])
 def generate_mosaic_api():
     payload = request.get_json() or {}
     grid_size = payload.get('grid_size', 15)
-    # Attempt to use utils.mosaic.generate_mosaic — it may depend on Streamlit progress so wrap in try/except
+    if payload.get('output') == 'dzi':
+        try:
+            return jsonify({'dzi_url': generate_pyramid(grid_size)})
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        except Exception as e:
+            return jsonify({'error': 'server-side mosaic generation not available', 'details': str(e)}), 501
+    # Render with the Streamlit-free stages of utils.mosaic so this works in any WSGI worker
     try:
+        from utils import analysis
         from utils import mosaic as mosaic_util
         target = settings_util.load_settings().get('target_image')
-        tile_dir = PHOTOS_DIR
         output_path = os.path.join(DATA_DIR, 'mosaic.jpg')
-        # Many implementations of generate_mosaic expect different params; attempt the common signature
+        tile_size = analysis.tile_size_for_grid(grid_size)
         try:
-            tile_size = max(5, 1600 // max(1, int(grid_size)))
-            success = mosaic_util.generate_mosaic(target, tile_dir, output_path, tile_size=tile_size)
-        except Exception:
-            # fallback to calling with defaults
-            success = mosaic_util.generate_mosaic(target, tile_dir, output_path)
+            index = mosaic_util.build_tile_index(PHOTOS_DIR, tile_size)
+            mosaic_util.render_mosaic(target, index, output_path)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
 
         if not os.path.exists(output_path):
             return jsonify({'error': 'mosaic not produced'}), 500
@@ -154,7 +232,7 @@ def generate_mosaic_api():
         data_url = f'data:image/jpeg;base64,{b}'
         return jsonify({'mosaic_data_url': data_url})
     except Exception as e:
-        # If mosaic util uses streamlit it may error — return a clear message to the frontend
+        # e.g. opencv/scipy not installed on this server
         return jsonify({'error': 'server-side mosaic generation not available', 'details': str(e)}), 501
 
 
@@ -0,0 +1,11 @@
+# Production serving for backend_api:
+#   gunicorn -c gunicorn.conf.py backend_api:app
+# Workers share data/ safely through the locks and atomic replaces in utils/storage.py.
+import multiprocessing
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+# Mosaic generation can take a while on large photo pools
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "300"))
+accesslog = "-"
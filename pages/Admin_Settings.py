@@ -1,5 +1,6 @@
 import streamlit as st
-from utils.settings import load_settings, save_settings
+from utils.settings import load_settings, update_settings
+from utils import storage
 from datetime import datetime
 import os
 from PIL import Image
@@ -36,17 +37,18 @@ with col2:
 if target_upload:
     os.makedirs("data/photos", exist_ok=True)
     target_path = "data/photos/graduate_target.jpg"
-    Image.open(target_upload).save(target_path)
-    settings["target_image"] = target_path
+    with storage.atomic_path(target_path) as tmp:
+        Image.open(target_upload).save(tmp, format="JPEG")
+    with update_settings() as saved:
+        saved["target_image"] = target_path
     st.success("Target image updated! It will now be used as background.")
     st.rerun()
 
-# Save settings
-settings["unlock_date"] = datetime.combine(unlock_date, datetime.min.time())
-settings["graduate_email"] = graduate_email.strip()
-
 if st.button("💾 Save All Settings", type="primary"):
-    save_settings(settings)
+    # Only write the keys edited here, so a concurrent target upload via the API is kept
+    with update_settings() as saved:
+        saved["unlock_date"] = datetime.combine(unlock_date, datetime.min.time())
+        saved["graduate_email"] = graduate_email.strip()
     st.success("Settings saved successfully!")
     st.rerun()
 
@@ -2,6 +2,7 @@ import streamlit as st
 import pandas as pd
 import os
 from datetime import datetime
+from utils import storage
 
 st.title("📝 Leave a Secret Message")
 
@@ -15,12 +16,15 @@ if st.button("Submit Message", type="primary"):
     else:
         os.makedirs("data", exist_ok=True)
         file = "data/messages.csv"
-        if not os.path.exists(file):
-            pd.DataFrame(columns=["message", "timestamp"]).to_csv(file, index=False)
-        
-        df = pd.read_csv(file)
-        new_row = pd.DataFrame([{"message": message.strip(), "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M")}])
-        pd.concat([df, new_row], ignore_index=True).to_csv(file, index=False)
+        with storage.file_lock(file):
+            if os.path.exists(file):
+                df = pd.read_csv(file)
+            else:
+                df = pd.DataFrame(columns=["message", "timestamp"])
+
+            new_row = pd.DataFrame([{"message": message.strip(), "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M")}])
+            with storage.atomic_path(file) as tmp:
+                pd.concat([df, new_row], ignore_index=True).to_csv(tmp, index=False)
         
         st.success("Message saved secretly! 🤫")
         st.balloons()
\ No newline at end of file
@@ -1,6 +1,7 @@
 import streamlit as st
 import os
 from PIL import Image
+from utils import storage
 
 st.title("📸 Upload a Memory Photo")
 
@@ -11,6 +12,8 @@ uploaded = st.file_uploader("Choose a photo", type=["jpg", "jpeg", "png", "webp"
 if uploaded:
     os.makedirs("data/photos", exist_ok=True)
     path = f"data/photos/{uploaded.name}"
-    Image.open(uploaded).save(path)
+    image_format = Image.registered_extensions().get(os.path.splitext(path)[1].lower())
+    with storage.atomic_path(path) as tmp:
+        Image.open(uploaded).save(tmp, format=image_format)
     st.image(uploaded, caption="Uploaded!", use_column_width=True)
     st.success("Photo added to the Memory Mosaic collection! 🎉")
\ No newline at end of file
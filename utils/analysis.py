@@ -0,0 +1,216 @@
+"""Cached target analysis: per-region LAB means and difficulty ordering.
+
+The target is decoded and converted to LAB once, and the region means for
+every tile size are then taken from that one uint8 LAB image with blocked
+integer sums (a reshape view, no float copy), so peak memory stays close to
+the size of the image itself.
+
+Results are cached per target content hash, in memory and under CACHE_DIR, so
+re-rendering a portrait or moving the grid-size slider (every size in
+GRID_SIZES is computed in the first pass) skips target processing. One-off
+callers such as the batch CLI pass cache=False to compute only the requested
+size and leave the disk cache alone.
+Difficulty orderings are cached too, keyed additionally by the tile index they
+were ranked against (TileIndex.fingerprint); only the latest ordering per tile
+size is kept on disk, and at most CACHE_TARGETS_KEPT targets.
+"""
+
+import hashlib
+import os
+import shutil
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from utils import storage
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "cache", "analysis")
+CACHE_TARGETS_KEPT = 32
+MEMORY_CACHE_TARGETS = 8
+MEMORY_CACHE_HASHES = 256
+
+MOSAIC_WIDTH = 1600
+GRID_SIZES = range(10, 26)  # the frontend's grid-density slider
+DEFAULT_TILE_SIZE = 20  # Streamlit page and CLI default
+
+
+def tile_size_for_grid(grid_size):
+    """Tile size backend_api uses for a grid_size x grid_size request."""
+    return max(5, MOSAIC_WIDTH // max(1, int(grid_size)))
+
+
+# Sizes computed alongside whichever one is requested, so moving the grid
+# slider never needs another pass over the target.
+ANALYSIS_TILE_SIZES = tuple(sorted({tile_size_for_grid(g) for g in GRID_SIZES} | {DEFAULT_TILE_SIZE}))
+
+_features = OrderedDict()  # target hash -> {tile_size: (region_avgs_flat, grid_h, grid_w)}
+_orders = OrderedDict()  # (target hash, tile_size, index fingerprint) -> region order
+_hashes = OrderedDict()  # (path, mtime, size) -> target hash
+
+
+def _remember(cache, key, value, limit=MEMORY_CACHE_TARGETS):
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > limit:
+        cache.popitem(last=False)
+
+
+def target_hash(target_image_path):
+    """Content hash of the target file (memoised on path, mtime and size)."""
+    if not target_image_path or not os.path.exists(target_image_path):
+        raise ValueError("Target image not set.")
+    stat = os.stat(target_image_path)
+    key = (os.path.abspath(target_image_path), stat.st_mtime_ns, stat.st_size)
+    if key in _hashes:
+        _hashes.move_to_end(key)
+        return _hashes[key]
+    h = hashlib.sha1()
+    with open(target_image_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    _remember(_hashes, key, h.hexdigest(), limit=MEMORY_CACHE_HASHES)
+    return _hashes[key]
+
+
+def _target_dir(digest):
+    return os.path.join(CACHE_DIR, digest)
+
+
+def _features_path(digest, tile_size):
+    return os.path.join(_target_dir(digest), f"features_{tile_size}.npz")
+
+
+def _order_path(digest, tile_size, fingerprint):
+    return os.path.join(_target_dir(digest), f"order_{tile_size}_{fingerprint}.npy")
+
+
+def _prune_targets(keep):
+    """Drop the least recently used target directories beyond keep."""
+    if not os.path.isdir(CACHE_DIR):
+        return
+    dirs = [os.path.join(CACHE_DIR, d) for d in os.listdir(CACHE_DIR)]
+    dirs = sorted((d for d in dirs if os.path.isdir(d)), key=os.path.getmtime)
+    for stale in dirs[:max(0, len(dirs) - keep)]:
+        shutil.rmtree(stale, ignore_errors=True)
+
+
+def _prune_orders(digest, tile_size, fingerprint):
+    """Remove orderings for this tile size ranked against an older tile set."""
+    prefix = f"order_{tile_size}_"
+    current = os.path.basename(_order_path(digest, tile_size, fingerprint))
+    for name in os.listdir(_target_dir(digest)):
+        if name.startswith(prefix) and name.endswith(".npy") and name != current:
+            try:
+                os.remove(os.path.join(_target_dir(digest), name))
+            except FileNotFoundError:
+                pass  # another worker pruned it first
+
+
+def _load_features(digest, tile_size):
+    """Features from the disk cache, or None if not cached (or pruned meanwhile)."""
+    try:
+        with np.load(_features_path(digest, tile_size)) as data:
+            entry = (data["region_avgs"], int(data["grid_h"]), int(data["grid_w"]))
+    except FileNotFoundError:
+        return None
+    os.utime(_target_dir(digest))  # mark recently used for _prune_targets
+    return entry
+
+
+def compute_region_features(target_lab, tile_sizes):
+    """Region means of a uint8 LAB image for every tile size.
+
+    Each size crops the image to whole tiles and splits it into a
+    (grid_h, tile, grid_w, tile, 3) view, which needs no copy; the blocks are
+    summed in uint32 (exact for tiles up to 257 px) and only the small per-region
+    result is converted to float.
+    Returns {tile_size: (region_avgs_flat, grid_h, grid_w)}; sizes larger than
+    the image are left out.
+    """
+    h, w = target_lab.shape[:2]
+    out = {}
+    for tile_size in tile_sizes:
+        grid_h, grid_w = h // tile_size, w // tile_size
+        if not grid_h or not grid_w:
+            continue
+        blocks = target_lab[:grid_h * tile_size, :grid_w * tile_size].reshape(grid_h, tile_size, grid_w, tile_size, 3)
+        sums = blocks.sum(axis=(1, 3), dtype=np.uint32)
+        out[tile_size] = ((sums / (tile_size * tile_size)).reshape(-1, 3), grid_h, grid_w)
+    return out
+
+
+def region_features(target_image_path, tile_size, cache=True):
+    """Return (region_avgs_flat, grid_h, grid_w) for the target at tile_size.
+
+    With cache=False only tile_size is computed and nothing is read from or
+    written to CACHE_DIR.
+    Raises ValueError when the target cannot be loaded or is smaller than a tile.
+    """
+    digest = target_hash(target_image_path)
+    cached = _features.get(digest, {})
+    if tile_size in cached:
+        _features.move_to_end(digest)
+        return cached[tile_size]
+
+    entry = _load_features(digest, tile_size) if cache else None
+    if entry is not None:
+        _remember(_features, digest, {**cached, tile_size: entry})
+        return entry
+
+    target_img = cv2.imread(target_image_path)
+    if target_img is None:
+        raise ValueError("Failed to load target image.")
+    target_lab = cv2.cvtColor(target_img, cv2.COLOR_BGR2LAB)
+    del target_img  # only the LAB copy is needed from here on
+
+    sizes = sorted(set(ANALYSIS_TILE_SIZES) | {tile_size}) if cache else [tile_size]
+    computed = compute_region_features(target_lab, sizes)
+    if tile_size not in computed:
+        raise ValueError("Target image is smaller than one tile.")
+    if not cache:
+        _remember(_features, digest, {**cached, **computed})
+        return computed[tile_size]
+
+    if not os.path.isdir(_target_dir(digest)):
+        _prune_targets(CACHE_TARGETS_KEPT - 1)
+    os.makedirs(_target_dir(digest), exist_ok=True)
+    for size, (region_avgs, grid_h, grid_w) in computed.items():
+        size_path = _features_path(digest, size)
+        with storage.atomic_path(size_path) as tmp, open(tmp, "wb") as f:
+            np.savez(f, region_avgs=region_avgs, grid_h=grid_h, grid_w=grid_w)
+    _remember(_features, digest, {**cached, **computed})
+    return computed[tile_size]
+
+
+def rank_regions(index, region_avgs_flat):
+    """Region indices sorted hardest first (largest distance to the nearest tile)."""
+    _, min_dists = index.tree.query(region_avgs_flat, k=1)
+    return np.argsort(-min_dists.flatten())
+
+
+def difficulty_order(target_image_path, index, cache=True):
+    """Cached rank_regions for the target against this tile index (see region_features for cache)."""
+    digest = target_hash(target_image_path)
+    key = (digest, index.tile_size, index.fingerprint)
+    if key in _orders:
+        _orders.move_to_end(key)
+        return _orders[key]
+
+    path = _order_path(*key)
+    order = None
+    if cache:
+        try:
+            order = np.load(path)
+        except FileNotFoundError:
+            pass  # not cached yet, or pruned by another worker
+    if order is None:
+        region_avgs_flat, _, _ = region_features(target_image_path, index.tile_size, cache=cache)
+        order = rank_regions(index, region_avgs_flat)
+    if cache and not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with storage.atomic_path(path) as tmp, open(tmp, "wb") as f:
+            np.save(f, order)
+        _prune_orders(*key)
+    _remember(_orders, key, order)
+    return order
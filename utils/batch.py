@@ -0,0 +1,131 @@
+"""Render mosaics for many targets against one shared pool of photos.
+
+The tile index (resized tiles + KDTree) is built once and handed to every
+worker in a process pool, so each target only pays for its own matching.
+
+Usage:
+    python -m utils.batch portraits/*.jpg --tiles data/photos --out-dir data/batch
+
+A summary with per-target timings is written to <out-dir>/summary.json.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from utils import mosaic as mosaic_util
+
+_worker_index = None
+
+
+def _init_worker(index):
+    global _worker_index
+    _worker_index = index
+
+
+def _render_one(target, output_path, top_k, output):
+    start = time.perf_counter()
+    entry = {"target": target, "output": output_path}
+    try:
+        # Each portrait is rendered once, so the shared analysis cache would only churn
+        result = mosaic_util.render_mosaic(target, _worker_index, output_path, top_k=top_k, output=output,
+                                           cache=False)
+        entry.update(result)
+        entry["ok"] = True
+    except Exception as e:
+        entry["ok"] = False
+        entry["error"] = str(e)
+    entry["seconds"] = round(time.perf_counter() - start, 3)
+    return entry
+
+
+def output_paths_for(targets, out_dir, output="jpg"):
+    """One output path per target, unique even when basenames repeat.
+
+    a/jane.jpg and b/jane.jpg become jane_mosaic.jpg and jane-2_mosaic.jpg;
+    summary.json records which target went where.
+    """
+    used = set()
+    paths = []
+    for target in targets:
+        base = os.path.splitext(os.path.basename(target))[0]
+        stem, n = base, 1
+        while stem in used:
+            n += 1
+            stem = f"{base}-{n}"
+        used.add(stem)
+        paths.append(os.path.join(out_dir, f"{stem}_mosaic.{output}"))
+    return paths
+
+
+def run_batch(targets, tile_dir, out_dir, tile_size=20, top_k=20, workers=None, output="jpg"):
+    """Build the tile index once and render every target in a process pool.
+
+    Returns the summary dict, which is also written to <out_dir>/summary.json.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    total_start = time.perf_counter()
+
+    index_start = time.perf_counter()
+    index = mosaic_util.build_tile_index(tile_dir, tile_size)
+    index_seconds = round(time.perf_counter() - index_start, 3)
+
+    output_paths = output_paths_for(targets, out_dir, output)
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(index,)) as pool:
+        futures = [
+            pool.submit(_render_one, target, output_path, top_k, output)
+            for target, output_path in zip(targets, output_paths)
+        ]
+        for future in as_completed(futures):
+            entry = future.result()
+            status = "ok" if entry["ok"] else f"failed: {entry['error']}"
+            print(f"{entry['target']}: {status} ({entry['seconds']}s)")
+            results.append(entry)
+
+    order = {output_path: i for i, output_path in enumerate(output_paths)}
+    results.sort(key=lambda e: order[e["output"]])
+
+    summary = {
+        "tile_dir": tile_dir,
+        "tile_size": tile_size,
+        "top_k": top_k,
+        "num_tiles": len(index),
+        "index_seconds": index_seconds,
+        "total_seconds": round(time.perf_counter() - total_start, 3),
+        "targets": results,
+    }
+    with open(os.path.join(out_dir, "summary.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render one mosaic per target image from a shared photo pool.")
+    parser.add_argument("targets", nargs="+", help="target (portrait) images")
+    parser.add_argument("--tiles", default="data/photos", help="directory of tile photos (default: data/photos)")
+    parser.add_argument("--out-dir", default="data/batch", help="where mosaics and summary.json go (default: data/batch)")
+    parser.add_argument("--tile-size", type=int, default=20)
+    parser.add_argument("--top-k", type=int, default=20)
+    parser.add_argument("--format", choices=("jpg", "dzi"), default="jpg",
+                        help="single JPEG or a Deep Zoom tile pyramid (default: jpg)")
+    parser.add_argument("--workers", type=int, default=None, help="process pool size (default: CPU count)")
+    args = parser.parse_args(argv)
+
+    try:
+        summary = run_batch(args.targets, args.tiles, args.out_dir, args.tile_size, args.top_k, args.workers, args.format)
+    except ValueError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+
+    failed = [e for e in summary["targets"] if not e["ok"]]
+    print(f"{len(summary['targets']) - len(failed)}/{len(summary['targets'])} mosaics in "
+          f"{summary['total_seconds']}s (tile index {summary['index_seconds']}s)")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
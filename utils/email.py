@@ -4,6 +4,8 @@ from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from typing import List, Optional
 
+from utils import storage
+
 
 def _load_email_config():
     """Load SMTP config from environment variables.
@@ -43,6 +45,13 @@ def send_unlock_email(graduate_email: str, app_url: str, messages: Optional[List
 
     Returns True on success, raises an exception on failure.
     """
+    data_flag = os.path.join('data', 'email_sent.txt')
+    # Hold the flag's lock for the whole check-and-send so two workers cannot both send
+    with storage.file_lock(data_flag):
+        return _send_unlock_email(graduate_email, app_url, messages, force)
+
+
+def _send_unlock_email(graduate_email: str, app_url: str, messages: Optional[List[str]] = None, force: bool = False) -> bool:
     data_flag = os.path.join('data', 'email_sent.txt')
     if not force and os.path.exists(data_flag):
         # already sent
@@ -106,9 +115,7 @@ def send_unlock_email(graduate_email: str, app_url: str, messages: Optional[List
         server.sendmail(cfg['sender_email'], [graduate_email], msg.as_string())
         server.quit()
 
-        os.makedirs('data', exist_ok=True)
-        with open(data_flag, 'w') as f:
-            f.write('sent')
+        storage.atomic_write(data_flag, 'sent')
         return True
     except Exception as e:
         # do not swallow exception — let the caller handle/log it
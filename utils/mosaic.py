@@ -1,40 +1,46 @@
 import cv2
+import hashlib
 import numpy as np
 import os
-import streamlit as st
+import random  # For randomization among top-k
 from scipy import spatial  # For KDTree
 
-def generate_mosaic(target_image_path, tile_dir, output_path="data/mosaic.jpg", tile_size=20, top_k=20):
-    if not os.path.exists(target_image_path):
-        st.error("Target image not set.")
-        return False
+from utils import analysis
+from utils import storage
+from utils.pyramid import PyramidWriter
 
-    target_img = cv2.imread(target_image_path)
-    if target_img is None:
-        st.error("Failed to load target image.")
-        return False
+TILE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
 
-    h, w = target_img.shape[:2]
-    target_img = target_img[:(h // tile_size) * tile_size, :(w // tile_size) * tile_size]
-    target_lab = cv2.cvtColor(target_img, cv2.COLOR_BGR2LAB)
-
-    # Region averages in LAB
-    strides = target_lab.strides
-    grid_h, grid_w = target_lab.shape[0] // tile_size, target_lab.shape[1] // tile_size
-    patches = np.lib.stride_tricks.as_strided(
-        target_lab,
-        shape=(grid_h, grid_w, tile_size, tile_size, 3),
-        strides=(strides[0] * tile_size, strides[1] * tile_size, *strides)
-    )
-    region_avgs = np.mean(patches, axis=(2, 3))
-    region_avgs_flat = region_avgs.reshape(-1, 3)
-    num_regions = len(region_avgs_flat)
 
-    # Load tiles with progress
-    progress_bar = st.progress(0, text="Processing photo tiles...")
+class TileIndex:
+    """Resized tiles, their LAB averages and a KDTree over those averages.
+
+    Building this is the expensive part of a render, so it is built once and
+    reused across targets (see utils/batch.py).
+    """
+
+    def __init__(self, tiles, tile_avgs, tile_size):
+        self.tiles = tiles
+        self.tile_avgs = tile_avgs
+        self.tile_size = tile_size
+        self.tree = spatial.KDTree(tile_avgs)
+        # Identifies this tile set in cached difficulty orderings (utils/analysis.py)
+        self.fingerprint = hashlib.sha1(np.ascontiguousarray(tile_avgs).tobytes()).hexdigest()[:16]
+
+    def __len__(self):
+        return len(self.tiles)
+
+
+def build_tile_index(tile_dir, tile_size=20, progress=None):
+    """Load every photo in tile_dir, resize to tile_size and index its LAB mean.
+
+    progress, if given, is called as progress(fraction, text).
+    Raises ValueError when no usable photo is found.
+    """
     tiles = []
     tile_avgs = []
-    files = [f for f in os.listdir(tile_dir) if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
+    # Hidden names are in-flight uploads (see storage.atomic_path)
+    files = [f for f in os.listdir(tile_dir) if f.lower().endswith(TILE_EXTENSIONS) and not f.startswith('.')]
     total_files = len(files)
 
     for idx, file in enumerate(files):
@@ -46,31 +52,33 @@ def generate_mosaic(target_image_path, tile_dir, output_path="data/mosaic.jpg",
             avg_lab = np.mean(tile_lab, axis=(0, 1))
             tiles.append(tile)
             tile_avgs.append(avg_lab)
-        progress_bar.progress((idx + 1) / total_files, text=f"Loading tile {idx + 1}/{total_files}")
+        if progress:
+            progress((idx + 1) / total_files, f"Loading tile {idx + 1}/{total_files}")
 
     if not tiles:
-        st.error("No valid photos found in uploads.")
-        return False
+        raise ValueError("No valid photos found in uploads.")
+
+    return TileIndex(np.array(tiles), np.array(tile_avgs), tile_size)
 
-    tile_avgs = np.array(tile_avgs)
-    num_tiles = len(tiles)
 
-    # Advanced: Build KDTree for fast nearest neighbor in LAB color space
-    tree = spatial.KDTree(tile_avgs)
+def assign_tiles(index, region_avgs_flat, top_k=20, progress=None, region_order=None):
+    """Greedy no-duplicate assignment (hardest regions first) with top-k randomization.
+
+    Pass region_order (e.g. the cached analysis.difficulty_order) to skip
+    ranking the regions here.
+    Returns (best_indices, duplicates_used).
+    """
+    tree = index.tree
+    tile_avgs = index.tile_avgs
+    num_regions = len(region_avgs_flat)
 
-    # Greedy no-duplicate assignment (hardest regions first) with top-k randomization for diversity
-    progress_bar.text("Assigning unique tiles with advanced matching...")
-    
-    # Compute difficulty: min distance for each region using tree.query
-    _, min_dists = tree.query(region_avgs_flat, k=1)
-    region_order = np.argsort(-min_dists.flatten())  # Hardest first
+    if region_order is None:
+        region_order = analysis.rank_regions(index, region_avgs_flat)
 
-    available = set(range(num_tiles))  # Use set for fast removal
+    available = set(range(len(index)))  # Use set for fast removal
     best_indices = np.zeros(num_regions, dtype=int)
     duplicates_used = False
 
-    import random  # For randomization among top-k
-
     for count, region_idx in enumerate(region_order):
         if not available:
             duplicates_used = True
@@ -79,13 +87,13 @@ def generate_mosaic(target_image_path, tile_dir, output_path="data/mosaic.jpg",
             dists, idxs = tree.query(region_avgs_flat[remaining], k=1)
             best_indices[remaining] = idxs.flatten()
             break
-        
+
         # Query top-k nearest from all, then filter to available
         dists, idxs = tree.query(region_avgs_flat[region_idx], k=top_k)
-        
+
         # Find available candidates among top-k
-        avail_candidates = [i for i in idxs if i in available]
-        
+        avail_candidates = [i for i in np.atleast_1d(idxs) if i in available]
+
         if not avail_candidates:
             # If no available in top-k, take closest overall available (rare)
             avail_dists = np.linalg.norm(tile_avgs[list(available)] - region_avgs_flat[region_idx], axis=1)
@@ -94,25 +102,100 @@ def generate_mosaic(target_image_path, tile_dir, output_path="data/mosaic.jpg",
         else:
             # Random pick among available top-k for diversity
             best_tile_idx = random.choice(avail_candidates)
-        
+
         best_indices[region_idx] = best_tile_idx
         available.discard(best_tile_idx)
 
-        if (count + 1) % max(1, num_regions // 50) == 0:
-            progress_bar.progress((count + 1) / num_regions)
+        if progress and (count + 1) % max(1, num_regions // 50) == 0:
+            progress((count + 1) / num_regions, "Assigning unique tiles with advanced matching...")
+
+    return best_indices, duplicates_used
+
+
+def iter_mosaic_rows(index, best_indices, grid_h, grid_w):
+    """Yield the mosaic one tile row (tile_size pixels tall) at a time."""
+    best_indices = np.asarray(best_indices).reshape(grid_h, grid_w)
+    for i in range(grid_h):
+        yield np.hstack(index.tiles[best_indices[i]])
+
+
+def assemble_mosaic(index, best_indices, grid_h, grid_w):
+    """Stitch the assigned tiles into one BGR image."""
+    return np.vstack(list(iter_mosaic_rows(index, best_indices, grid_h, grid_w)))
 
-    if duplicates_used:
-        st.warning("Not enough unique photos — some tiles reused for best fit.")
 
-    # Build mosaic
-    progress_bar.text("Constructing final mosaic...")
-    best_tiles = np.array(tiles)[best_indices]
-    grid = best_tiles.reshape(grid_h, grid_w, tile_size, tile_size, 3)
-    rows = [np.hstack(grid[i]) for i in range(grid_h)]
-    mosaic = np.vstack(rows)
+def write_image(path, img):
+    """Encode img in the format of path's extension and replace path atomically."""
+    ok, buf = cv2.imencode(os.path.splitext(path)[1] or '.jpg', img)
+    if not ok:
+        raise ValueError(f"Could not encode image for {path}")
+    # Replace atomically so concurrent readers never see a half-written file
+    with storage.file_lock(path):
+        storage.atomic_write(path, buf.tobytes())
+
+
+def render_mosaic(target_image_path, index, output_path="data/mosaic.jpg", top_k=20, progress=None, output="jpg",
+                  cache=True):
+    """Render one target against a prebuilt TileIndex and write it to output_path.
+
+    output="jpg" writes a single image. output="dzi" treats output_path as a
+    Deep Zoom manifest (e.g. data/mosaic.dzi) and streams the rows into a tile
+    pyramid next to it instead of building the full canvas.
+    cache=False skips the on-disk target analysis cache (see utils/analysis.py).
+
+    Returns a dict with grid dimensions and whether tiles had to be reused.
+    Raises ValueError when the target cannot be loaded.
+    """
+    region_avgs_flat, grid_h, grid_w = analysis.region_features(target_image_path, index.tile_size, cache=cache)
+    region_order = analysis.difficulty_order(target_image_path, index, cache=cache)
+    best_indices, duplicates_used = assign_tiles(
+        index, region_avgs_flat, top_k=top_k, progress=progress, region_order=region_order
+    )
+
+    if progress:
+        progress(1.0, "Constructing final mosaic...")
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    if output == "dzi":
+        tile_size = index.tile_size
+        writer = PyramidWriter(output_path, grid_w * tile_size, grid_h * tile_size)
+        try:
+            for row in iter_mosaic_rows(index, best_indices, grid_h, grid_w):
+                writer.feed(row)
+            writer.close()
+        except Exception:
+            writer.abort()
+            raise
+    else:
+        mosaic = assemble_mosaic(index, best_indices, grid_h, grid_w)
+        write_image(output_path, mosaic)  # Save in BGR
+    return {
+        "grid_h": grid_h,
+        "grid_w": grid_w,
+        "duplicates_used": duplicates_used,
+    }
+
+
+def generate_mosaic(target_image_path, tile_dir, output_path="data/mosaic.jpg", tile_size=20, top_k=20):
+    import streamlit as st  # Imported lazily so the CLI/API can render without Streamlit
+
+    progress_bar = st.progress(0, text="Processing photo tiles...")
+
+    def progress(fraction, text):
+        progress_bar.progress(fraction, text=text)
+
+    try:
+        # Fail on a missing target before spending time on the tiles
+        analysis.region_features(target_image_path, tile_size)
+        index = build_tile_index(tile_dir, tile_size, progress=progress)
+        result = render_mosaic(target_image_path, index, output_path, top_k=top_k, progress=progress)
+    except ValueError as e:
+        progress_bar.empty()
+        st.error(str(e))
+        return False
+
+    if result["duplicates_used"]:
+        st.warning("Not enough unique photos — some tiles reused for best fit.")
 
-    os.makedirs("data", exist_ok=True)
-    cv2.imwrite(output_path, mosaic)  # Save in BGR
     progress_bar.empty()
     st.success("✨ Memory Mosaic generated with advanced KDTree matching and randomized diversity!")
-    return True
\ No newline at end of file
+    return True
@@ -0,0 +1,125 @@
+"""Deep Zoom (DZI) tile pyramid writer fed one horizontal strip at a time.
+
+Layout follows the Deep Zoom convention understood by OpenSeadragon & co:
+
+    mosaic.dzi                       XML manifest
+    mosaic_files/<level>/<col>_<row>.jpg
+
+Level max (= ceil(log2(max(w, h)))) is full resolution and every level below
+it halves the size, down to a single pixel at level 0. Strips are cut into
+tiles as soon as a full band is buffered, and each band is downsampled and
+passed to the next level, so the full canvas is never held in memory.
+
+Tiles are written into a hidden staging directory next to the output; close()
+swaps it in for <name>_files and then replaces the manifest atomically, so
+re-rendering into the same place never exposes a half-written pyramid.
+"""
+
+import math
+import os
+import secrets
+import shutil
+
+import cv2
+import numpy as np
+
+from utils import storage
+
+DEFAULT_TILE_SIZE = 256
+DEFAULT_QUALITY = 85
+
+
+class _LevelWriter:
+    def __init__(self, files_dir, level, width, height, tile_size, quality):
+        self.level = level
+        self.width = width
+        self.height = height
+        self.tile_size = tile_size
+        self.quality = quality
+        self.dir = os.path.join(files_dir, str(level))
+        os.makedirs(self.dir, exist_ok=True)
+        self.buffer = []
+        self.buffered = 0
+        self.row = 0
+        self.parent = None
+        if level > 0:
+            self.parent = _LevelWriter(files_dir, level - 1, math.ceil(width / 2), math.ceil(height / 2),
+                                       tile_size, quality)
+
+    def feed(self, strip):
+        self.buffer.append(strip)
+        self.buffered += strip.shape[0]
+        while self.buffered >= self.tile_size:
+            band = np.vstack(self.buffer)
+            self._emit(band[:self.tile_size])
+            rest = band[self.tile_size:]
+            self.buffer = [rest] if len(rest) else []
+            self.buffered = len(rest)
+
+    def close(self):
+        if self.buffered:
+            self._emit(np.vstack(self.buffer))
+            self.buffer = []
+            self.buffered = 0
+        if self.parent:
+            self.parent.close()
+
+    def _emit(self, band):
+        for col, x in enumerate(range(0, self.width, self.tile_size)):
+            path = os.path.join(self.dir, f"{col}_{self.row}.jpg")
+            cv2.imwrite(path, band[:, x:x + self.tile_size], [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        self.row += 1
+        if self.parent:
+            size = (self.parent.width, math.ceil(band.shape[0] / 2))
+            self.parent.feed(cv2.resize(band, size, interpolation=cv2.INTER_AREA))
+
+
+class PyramidWriter:
+    """Stream BGR strips (full width, any height) of a width x height image into a DZI pyramid."""
+
+    def __init__(self, manifest_path, width, height, tile_size=DEFAULT_TILE_SIZE, quality=DEFAULT_QUALITY):
+        self.manifest_path = manifest_path
+        self.width = width
+        self.height = height
+        self.tile_size = tile_size
+        self.max_level = math.ceil(math.log2(max(width, height, 1)))
+        self.files_dir = os.path.splitext(manifest_path)[0] + "_files"
+        self.staging_dir = self._make_staging_dir()
+        self._top = _LevelWriter(self.staging_dir, self.max_level, width, height, tile_size, quality)
+
+    def _make_staging_dir(self):
+        parent = os.path.dirname(self.files_dir) or "."
+        os.makedirs(parent, exist_ok=True)
+        while True:
+            path = os.path.join(parent, f".{os.path.basename(self.files_dir)}.{secrets.token_hex(4)}")
+            try:
+                os.mkdir(path)  # not mkdtemp: that would leave the published tiles 0700
+                return path
+            except FileExistsError:
+                continue
+
+    def feed(self, strip):
+        self._top.feed(strip)
+
+    def abort(self):
+        """Discard the staged tiles, leaving any published pyramid untouched."""
+        shutil.rmtree(self.staging_dir, ignore_errors=True)
+
+    def close(self):
+        self._top.close()
+        manifest = (
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" '
+            f'Format="jpg" Overlap="0" TileSize="{self.tile_size}">\n'
+            f'  <Size Width="{self.width}" Height="{self.height}"/>\n'
+            '</Image>\n'
+        )
+        old_dir = None
+        with storage.file_lock(self.manifest_path):
+            if os.path.isdir(self.files_dir):
+                old_dir = self.staging_dir + ".old"
+                os.replace(self.files_dir, old_dir)
+            os.replace(self.staging_dir, self.files_dir)
+            storage.atomic_write(self.manifest_path, manifest)
+        if old_dir:
+            shutil.rmtree(old_dir, ignore_errors=True)
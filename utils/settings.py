@@ -1,20 +1,32 @@
 import pickle
-import os
+from contextlib import contextmanager
 from datetime import datetime
 
+from utils import storage
+
 SETTINGS_FILE = "data/settings.pkl"
 
-def load_settings():
-    if os.path.exists(SETTINGS_FILE):
-        with open(SETTINGS_FILE, "rb") as f:
-            return pickle.load(f)
+
+def _default_settings():
     return {
         "unlock_date": None,
         "graduate_email": None,
         "target_image": None
     }
 
+
+def load_settings():
+    return storage.read_pickle(SETTINGS_FILE) or _default_settings()
+
 def save_settings(settings):
-    os.makedirs("data", exist_ok=True)
-    with open(SETTINGS_FILE, "wb") as f:
-        pickle.dump(settings, f)
\ No newline at end of file
+    with storage.file_lock(SETTINGS_FILE):
+        storage.atomic_write(SETTINGS_FILE, pickle.dumps(settings))
+
+
+@contextmanager
+def update_settings():
+    """Read-modify-write the settings under the cross-process lock."""
+    with storage.file_lock(SETTINGS_FILE):
+        settings = load_settings()
+        yield settings
+        storage.atomic_write(SETTINGS_FILE, pickle.dumps(settings))
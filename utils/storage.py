@@ -0,0 +1,114 @@
+"""Cross-process safe access to the mutable files under data/.
+
+Every writer takes an exclusive flock on a lock file under LOCK_DIR (named by
+a hash of the target's absolute path, so output directories stay clean) and
+replaces the target atomically (write to a hidden ".<name>.*.tmp" file in the
+same directory, then os.replace), so readers in other worker processes always
+see either the old or the new file, never a partial one.
+
+On platforms without fcntl the lock is a no-op; that only matters when several
+processes write at once, which the production (gunicorn) mode never does there.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import secrets
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+LOCK_DIR = "data/.locks"
+TMP_SUFFIX = ".tmp"
+
+
+@contextmanager
+def file_lock(path):
+    """Hold an exclusive lock for path across processes."""
+    os.makedirs(LOCK_DIR, exist_ok=True)
+    name = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()
+    with open(os.path.join(LOCK_DIR, name + ".lock"), "a") as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+@contextmanager
+def atomic_path(path):
+    """Yield a temp path next to path; on success it replaces path atomically.
+
+    The temp name is hidden and ends in TMP_SUFFIX, so directory scans (e.g. the
+    tile loader) never pick up a half-written file. Writers that choose a format
+    from the file name must be told the format explicitly.
+    The result keeps path's current mode, or gets the umask default if new.
+    """
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    while True:
+        tmp = os.path.join(directory, f".{os.path.basename(path)}.{secrets.token_hex(4)}{TMP_SUFFIX}")
+        try:
+            # Unlike mkstemp (always 0600) this lets the process umask apply
+            fd = os.open(tmp, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666)
+            break
+        except FileExistsError:
+            continue
+    os.close(fd)
+    try:
+        yield tmp
+        if os.path.exists(path):
+            os.chmod(tmp, os.stat(path).st_mode & 0o7777)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def atomic_write(path, data):
+    """Atomically replace path with data (bytes or str)."""
+    mode = "wb" if isinstance(data, bytes) else "w"
+    with atomic_path(path) as tmp:
+        with open(tmp, mode) as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def read_json(path, default=None):
+    if not os.path.exists(path):
+        return default
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def write_json(path, obj):
+    with file_lock(path):
+        atomic_write(path, json.dumps(obj, indent=2))
+
+
+@contextmanager
+def update_json(path, default):
+    """Read-modify-write a JSON file under its lock.
+
+    with update_json(path, []) as messages:
+        messages.append(msg)
+    """
+    with file_lock(path):
+        obj = read_json(path, default)
+        yield obj
+        atomic_write(path, json.dumps(obj, indent=2))
+
+
+def read_pickle(path, default=None):
+    if not os.path.exists(path):
+        return default
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
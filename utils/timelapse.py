@@ -0,0 +1,262 @@
+"""Animated build-up of a mosaic for the unlock reveal.
+
+The tile assignment is computed once; frames then fill the canvas in the order
+the assignment placed the tiles (hardest regions first) over a dimmed, blurred
+copy of the target. Frames go through a small bounded queue to an encoder
+thread, so only a handful exist at any time no matter how many the clip has.
+
+Usage:
+    python -m utils.timelapse data/target.jpg --tiles data/photos --out data/reveal.mp4
+
+.mp4, .mov and .mkv use ffmpeg (H.264) when it is on PATH and fall back to
+cv2.VideoWriter; .gif needs ffmpeg. Other extensions are rejected.
+"""
+
+import argparse
+import math
+import os
+import queue
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from utils import analysis
+from utils import mosaic as mosaic_util
+from utils import storage
+
+BACKGROUND_DIM = 0.3
+# Output is written to a ".tmp" name first, so the container is passed explicitly
+FFMPEG_FORMATS = {".mp4": "mp4", ".mov": "mov", ".mkv": "matroska", ".gif": "gif"}
+
+
+class _FfmpegEncoder:
+    def __init__(self, path, ext, width, height, fps, palette_path=None):
+        cmd = [
+            "ffmpeg", "-y", "-loglevel", "error",
+            "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{width}x{height}", "-r", str(fps), "-i", "-",
+        ]
+        if palette_path:
+            cmd += ["-i", palette_path, "-lavfi", "paletteuse"]
+        else:
+            cmd += ["-c:v", "libx264", "-pix_fmt", "yuv420p", "-movflags", "+faststart"]
+        if ext in FFMPEG_FORMATS:
+            cmd += ["-f", FFMPEG_FORMATS[ext]]
+        # A file, not a pipe: nobody reads stderr until close(), and a full pipe would deadlock ffmpeg
+        self.stderr = tempfile.TemporaryFile()
+        self.proc = subprocess.Popen(cmd + [path], stdin=subprocess.PIPE, stderr=self.stderr)
+
+    def write(self, frame):
+        self.proc.stdin.write(frame.tobytes())
+
+    def close(self):
+        try:
+            self.proc.stdin.close()
+        except BrokenPipeError:
+            pass  # ffmpeg already exited; its own message is more useful
+        returncode = self.proc.wait()
+        self.stderr.seek(0)
+        stderr = self.stderr.read().decode(errors="replace")
+        self.stderr.close()
+        if returncode != 0:
+            raise RuntimeError(f"ffmpeg failed: {stderr.strip()}")
+
+
+class _OpenCVEncoder:
+    def __init__(self, path, ext, width, height, fps):
+        # cv2 picks the container from the file name, so write under the real extension
+        self.path = path
+        self.named_path = path + ext
+        self.writer = cv2.VideoWriter(self.named_path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+        if not self.writer.isOpened():
+            raise RuntimeError(f"Could not open a video writer for {ext} output")
+
+    def write(self, frame):
+        self.writer.write(frame)
+
+    def close(self):
+        self.writer.release()
+        os.replace(self.named_path, self.path)
+
+
+class _FrameSink:
+    """Bounded queue in front of an encoder running on its own thread."""
+
+    def __init__(self, encoder, max_frames):
+        self.encoder = encoder
+        self.queue = queue.Queue(maxsize=max_frames)
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        try:
+            while True:
+                frame = self.queue.get()
+                if frame is None:
+                    return
+                self.encoder.write(frame)
+        except Exception as e:
+            self.error = e
+            # Keep draining so the producer never blocks on a dead encoder
+            while self.queue.get() is not None:
+                pass
+
+    def put(self, frame):
+        if self.error:
+            raise self.error
+        self.queue.put(frame.copy())
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.encoder.close()
+        if self.error:
+            raise self.error
+
+
+def _write_palette(frames, path):
+    """Save a 16x16 ffmpeg palette covering every colour the clip can show.
+
+    The first (background) and last (finished mosaic) frames between them
+    contain all colours, so no frame has to be kept around for palettegen.
+    """
+    sample = np.vstack([cv2.cvtColor(f, cv2.COLOR_BGR2RGB) for f in frames])
+    palette = Image.fromarray(sample).quantize(colors=256).getpalette()[:256 * 3]
+    colors = np.zeros((256, 3), dtype=np.uint8)
+    used = np.array(palette, dtype=np.uint8).reshape(-1, 3)
+    colors[:len(used)] = used
+    Image.fromarray(colors.reshape(16, 16, 3)).save(path)
+
+
+def _open_encoder(path, ext, width, height, fps, palette_frames):
+    ffmpeg = shutil.which("ffmpeg")
+    if ext == ".gif":
+        if not ffmpeg:
+            raise RuntimeError("GIF export needs ffmpeg on PATH.")
+        fd, palette_path = tempfile.mkstemp(suffix=".png")
+        os.close(fd)
+        _write_palette(palette_frames, palette_path)
+        return _FfmpegEncoder(path, ext, width, height, fps, palette_path), palette_path
+    if ffmpeg:
+        return _FfmpegEncoder(path, ext, width, height, fps), None
+    return _OpenCVEncoder(path, ext, width, height, fps), None
+
+
+def export_timelapse(target_image_path, index, output_path="data/reveal.mp4", top_k=20, fps=30,
+                     duration=6.0, hold=2.0, max_side=720, buffer_frames=8, mosaic_path=None):
+    """Compute one assignment for the target and encode its tile-by-tile build-up.
+
+    duration is the fill time in seconds, hold how long the finished mosaic stays
+    on screen. Frames are scaled so their longer side is at most max_side.
+    If mosaic_path is given, the still from the same assignment is written too,
+    so the reveal ends on exactly that image.
+    Returns a dict with grid dimensions, frame count and whether tiles were reused.
+    """
+    # Check the format before spending time on the assignment
+    ext = os.path.splitext(output_path)[1].lower()
+    if ext not in FFMPEG_FORMATS:
+        raise ValueError(f"Unsupported timelapse format {ext or '(none)'}; use one of {', '.join(FFMPEG_FORMATS)}.")
+
+    tile_size = index.tile_size
+    region_avgs_flat, grid_h, grid_w = analysis.region_features(target_image_path, tile_size)
+    region_order = analysis.difficulty_order(target_image_path, index)
+    best_indices, duplicates_used = mosaic_util.assign_tiles(
+        index, region_avgs_flat, top_k=top_k, region_order=region_order
+    )
+
+    if mosaic_path:
+        mosaic = mosaic_util.assemble_mosaic(index, best_indices, grid_h, grid_w)
+        mosaic_util.write_image(mosaic_path, mosaic)
+
+    # Work at frame resolution from the start: one small copy of each tile
+    cell = max(1, min(tile_size, max_side // max(grid_h, grid_w)))
+    cells = np.array([cv2.resize(t, (cell, cell), interpolation=cv2.INTER_AREA) for t in index.tiles])
+    # Even dimensions keep yuv420p encoders happy
+    width, height = grid_w * cell + (grid_w * cell) % 2, grid_h * cell + (grid_h * cell) % 2
+
+    # The background is upscaled from the cached region means, so the target is never decoded here
+    background = np.zeros((height, width, 3), dtype=np.uint8)
+    region_lab = region_avgs_flat.reshape(grid_h, grid_w, 3).round().astype(np.uint8)
+    region_bgr = cv2.cvtColor(region_lab, cv2.COLOR_LAB2BGR)
+    dimmed = cv2.resize(region_bgr, (grid_w * cell, grid_h * cell), interpolation=cv2.INTER_LINEAR)
+    background[:grid_h * cell, :grid_w * cell] = (dimmed * BACKGROUND_DIM).astype(np.uint8)
+
+    final = background.copy()
+    final[:grid_h * cell, :grid_w * cell] = (
+        cells[best_indices].reshape(grid_h, grid_w, cell, cell, 3).transpose(0, 2, 1, 3, 4).reshape(grid_h * cell, grid_w * cell, 3)
+    )
+
+    fill_frames = max(1, round(fps * duration))
+    per_frame = math.ceil(len(region_order) / fill_frames)
+    hold_frames = max(1, round(fps * hold))
+
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    with storage.file_lock(output_path), storage.atomic_path(output_path) as tmp:
+        encoder, palette_path = _open_encoder(tmp, ext, width, height, fps, [background, final])
+        try:
+            sink = _FrameSink(encoder, buffer_frames)
+            frames = 0
+            try:
+                canvas = background.copy()
+                sink.put(canvas)
+                frames += 1
+                for start in range(0, len(region_order), per_frame):
+                    for region_idx in region_order[start:start + per_frame]:
+                        y, x = (region_idx // grid_w) * cell, (region_idx % grid_w) * cell
+                        canvas[y:y + cell, x:x + cell] = cells[best_indices[region_idx]]
+                    sink.put(canvas)
+                    frames += 1
+                for _ in range(hold_frames):
+                    sink.put(canvas)
+                    frames += 1
+            finally:
+                sink.close()
+        finally:
+            if palette_path:
+                os.remove(palette_path)
+
+    return {
+        "grid_h": grid_h,
+        "grid_w": grid_w,
+        "frames": frames,
+        "width": width,
+        "height": height,
+        "duplicates_used": duplicates_used,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export a video/GIF of the mosaic assembling tile by tile.")
+    parser.add_argument("target", help="target (portrait) image")
+    parser.add_argument("--tiles", default="data/photos", help="directory of tile photos (default: data/photos)")
+    parser.add_argument("--out", default="data/reveal.mp4", help=".mp4 or .gif output (default: data/reveal.mp4)")
+    parser.add_argument("--mosaic", default=None, help="also write the matching still mosaic here")
+    parser.add_argument("--tile-size", type=int, default=20)
+    parser.add_argument("--top-k", type=int, default=20)
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--duration", type=float, default=6.0, help="seconds to fill the canvas (default: 6)")
+    parser.add_argument("--hold", type=float, default=2.0, help="seconds to show the finished mosaic (default: 2)")
+    parser.add_argument("--max-side", type=int, default=720, help="longest frame side in pixels (default: 720)")
+    args = parser.parse_args(argv)
+
+    try:
+        index = mosaic_util.build_tile_index(args.tiles, args.tile_size)
+        result = export_timelapse(args.target, index, args.out, top_k=args.top_k, fps=args.fps,
+                                  duration=args.duration, hold=args.hold, max_side=args.max_side,
+                                  mosaic_path=args.mosaic)
+    except (ValueError, RuntimeError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+
+    print(f"{args.out}: {result['frames']} frames at {result['width']}x{result['height']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())